@@ -1,4 +1,5 @@
 import os
+import time
 import requests
 import jwt
 import sys
@@ -13,6 +14,12 @@ SERVICE = "https://hebi.diamond.ac.uk/launcher/"
 CAS_SERVER = "https://auth.diamond.ac.uk/cas"
 CAS_VALIDATE_URL = "{}/serviceValidate".format(CAS_SERVER)
 JWT_ALGORITHM = 'HS256'
+# how long (in seconds) nginx may cache the decision to allow a request with a
+# particular token, and the upper bound on that value
+AUTH_CACHE_TTL = min(int(os.environ.get('AUTH_CACHE_TTL', '60')), 300)
+# how long (in seconds) nginx may cache the decision to deny a request with a
+# particular token
+AUTH_NEGATIVE_CACHE_TTL = 10
 
 
 def process_token(token):
@@ -26,12 +33,28 @@ def process_token(token):
     return payload
 
 
+def get_auth_cache_ttl(decoded_token):
+    '''
+    Get how long nginx may cache the decision to allow a request with the
+    given token, making sure that it's never cached beyond the token's expiry
+    (if it has one)
+    '''
+    ttl = AUTH_CACHE_TTL
+    if 'exp' in decoded_token:
+        ttl = min(ttl, int(decoded_token['exp'] - time.time()))
+    return max(ttl, 0)
+
+
 @app.route('/')
 def check_for_cookie():
     '''
     Check if the HTTP request that came from the launcher web app in the
     browser has a cookie that denotes if a user has authenticated to the
     launcher
+
+    The decision is returned with an X-Accel-Expires header so then nginx can
+    cache it (keyed on the token), and with the username in an X-Username
+    header so then nginx can pass it on to the launcher
     '''
     cookie = request.cookies.get('token')
     payload = {}
@@ -42,19 +65,28 @@ def check_for_cookie():
     else:
         # check the token to see if the 'username' value in it matches the
         # owner of the Hebi session (which is defined in the FEDID env var)
-        decoded_token = process_token(cookie)
+        try:
+            decoded_token = process_token(cookie)
+        except KeyError:
+            decoded_token = {}
 
         if 'username' not in decoded_token:
             # something is wrong with the token, so deny access
             payload['has_requestor_been_authenticated'] = False
-            return jsonify(payload)
+            resp = jsonify(payload)
+            resp.status_code = 403
+            resp.headers['X-Accel-Expires'] = str(AUTH_NEGATIVE_CACHE_TTL)
+            return resp
         else:
             # token has the username, so they have been authenticated to get to
             # the launcher page
             payload['has_requestor_been_authenticated'] = True
             payload['username'] = decoded_token['username']
 
-        return jsonify(payload)
+        resp = jsonify(payload)
+        resp.headers['X-Username'] = decoded_token['username']
+        resp.headers['X-Accel-Expires'] = str(get_auth_cache_ttl(decoded_token))
+        return resp
 
 
 @app.route('/validate_ticket')
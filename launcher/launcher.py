@@ -6,15 +6,26 @@ import yaml
 import signal
 import logging
 import pickle
+import time
+import uuid
+import math
+import random
+import hmac
+import hashlib
+import functools
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 from logging.handlers import RotatingFileHandler
 from datetime import datetime
 from threading import Lock
 
 from kubernetes import config, client, watch
 from kubernetes.client.rest import ApiException
-from flask import Flask, request
+from kubernetes.utils import parse_quantity
+from flask import Flask, Response, request, abort
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 from jinja2 import Environment, FileSystemLoader
 from ldap3 import Server, Connection, ALL
 
@@ -32,6 +43,52 @@ all_sessions_activity = {}
 # - check_for_inactive_sessions()
 thread_lock = Lock()
 
+# in-memory index of the Pods of all Hebi sessions, keyed by FedID, which is
+# periodically refreshed by the refresh_session_pods_index() background task so
+# then requests that need info about sessions don't need to call the k8s API
+session_pods_index = {}
+# when session_pods_index was last refreshed
+session_pods_index_updated = None
+session_pods_index_lock = Lock()
+
+# cache of the payloads of JWTs that have already been decoded, keyed by the
+# token, with the most recently used tokens at the end
+decoded_token_cache = OrderedDict()
+decoded_token_cache_lock = Lock()
+
+# cached view of the CPU/memory that is allocatable and requested on each
+# schedulable node in the cluster, keyed by node name, which is periodically
+# refreshed by the refresh_cluster_capacity() background task
+cluster_capacity = {}
+# queue of users waiting for there to be enough capacity in the cluster to
+# launch their session, in the order that they first requested a launch
+admission_queue = []
+# resources set aside for sessions that have been admitted but whose Pods
+# haven't yet been seen on a node by refresh_cluster_capacity(), keyed by
+# FedID
+admission_reservations = {}
+# the session (if any) that has been shutdown early to make room for the user
+# at the front of admission_queue, but whose Pod hasn't yet been seen to be
+# gone by refresh_cluster_capacity(); only one session is shutdown early at a
+# time
+pending_eviction = None
+# for being careful about the handling of cluster_capacity, admission_queue
+# and admission_reservations, which are read/modified by requests to
+# start_hebi() as well as the refresh_cluster_capacity() background task
+admission_lock = Lock()
+
+# progress of the rolling upgrade of running sessions to new images (if one has
+# been started), which is modified by the run_session_upgrade() background
+# task
+session_upgrade = None
+session_upgrade_lock = Lock()
+
+# rolling profile of the resource usage of each user's sessions, as
+# {fedid: {container name: deque of (cpu, memory) samples}}, which is added to
+# by the collect_session_usage_samples() background task
+session_usage_profiles = {}
+session_usage_profiles_lock = Lock()
+
 # if the launcher container is running on the Kubernetes cluster or locally
 # NOTE running locally doesn't work yet!
 IN_CLUSTER = None
@@ -41,6 +98,8 @@ k8s_apps_v1 = None
 k8s_api_v1 = None
 # provides function for modifying an Ingress
 k8s_api_networking_v1 = None
+# provides functions for getting Pod metrics from the metrics API
+k8s_api_custom = None
 # loader for loading templates with jinja2
 env = Environment(loader=FileSystemLoader('hebi-manifest-templates'))
 
@@ -68,14 +127,140 @@ SESSION_INACTIVITY_PERIOD_DAYS = int(os.environ['SESSION_INACTIVITY_PERIOD_DAYS'
 # the interval at which to write the all_sessions_activity dict to file
 WRITE_SESSION_ACTIVITY_INTERVAL = 300
 SESSION_ACTIVITY_FILE_PATH = '/persistent_data/all_sessions_activity.pkl'
+# the interval at which to refresh session_pods_index, in seconds
+SESSION_PODS_INDEX_REFRESH_INTERVAL = int(
+    os.environ.get('SESSION_PODS_INDEX_REFRESH_INTERVAL', '10'))
+
+# magic numbers related to admission control of session launches
+# the interval at which to refresh cluster_capacity, in seconds
+CLUSTER_CAPACITY_REFRESH_INTERVAL = int(
+    os.environ.get('CLUSTER_CAPACITY_REFRESH_INTERVAL', '15'))
+# if a queued user hasn't polled start_hebi() for longer than this (in
+# seconds), then they are assumed to have given up and are removed from the
+# queue
+ADMISSION_QUEUE_ENTRY_TIMEOUT = 60
+# how long (in seconds) the resources of an admitted session are set aside for
+# if its Pod is never seen on a node
+ADMISSION_RESERVATION_TIMEOUT = 300
+# if sessions that have been idle for a while can be shutdown early to make
+# room for queued users, and how long (in seconds) a session must have been
+# idle for to be shutdown early
+ADMISSION_EVICT_IDLE_SESSIONS = \
+    os.environ.get('ADMISSION_EVICT_IDLE_SESSIONS', 'False') == 'True'
+ADMISSION_EVICT_IDLE_AFTER_SECONDS = int(
+    os.environ.get('ADMISSION_EVICT_IDLE_AFTER_SECONDS', '7200'))
+# how long (in seconds) to wait for a newly created session Pod to be running
+# before giving up on waiting for it
+POD_STARTUP_TIMEOUT = 600
+
+# the maximum number of decoded JWTs to keep in decoded_token_cache
+DECODED_TOKEN_CACHE_SIZE = 1024
+
+# FedIDs of the users that are allowed to use the admin endpoints
+ADMIN_FEDIDS = set(filter(None, os.environ.get('ADMIN_FEDIDS', '').split(',')))
+# the maximum number of sessions that can be requested in a single page of the
+# admin session inventory
+MAX_SESSIONS_PER_PAGE = 500
+# the fields that the admin session inventory can be sorted by
+SESSION_INVENTORY_SORT_FIELDS = [
+    'fedid', 'phase', 'node', 'created', 'last_active', 'seconds_until_expiry'
+]
+
+# magic numbers related to rolling upgrades of running sessions
+# the names of the containers in a session's Pod whose images can be upgraded
+SESSION_CONTAINER_NAMES = ['api', 'web', 'file-browser-server',
+                           'cas-authenticator']
+# the registry prefixes that the images of an upgrade must come from, since
+# session containers run as the user and have /dls and /home mounted
+ALLOWED_SESSION_IMAGE_PREFIXES = [
+    prefix for prefix in os.environ.get(
+        'ALLOWED_SESSION_IMAGE_PREFIXES', 'gcr.io/diamond-pubreg/hebi/'
+    ).split(',') if prefix
+]
+# the default number of sessions that are upgraded at the same time
+DEFAULT_UPGRADE_MAX_CONCURRENT = 2
+# the default period (in seconds) within which a session must have responded
+# to a heartbeat-request to be considered in use, and thus be skipped by an
+# upgrade
+DEFAULT_UPGRADE_ACTIVE_WITHIN_SECONDS = 900
+# how long (in seconds) to wait for an upgraded session to become healthy
+# before halting the upgrade
+UPGRADE_HEALTH_TIMEOUT = 600
+# the interval at which to check if upgraded sessions are healthy, in seconds
+UPGRADE_HEALTH_CHECK_INTERVAL = 5
+
+# magic numbers related to right-sizing the resources of session containers
+# the resources that session containers get if there isn't enough known about
+# the user's usage yet, as (cpu in cores, memory in bytes)
+DEFAULT_SESSION_CONTAINER_RESOURCES = {
+    'api': (0.7, 200 * 2**20),
+    'web': (0.1, 50 * 2**20),
+    'file-browser-server': (0.15, 50 * 2**20),
+    'cas-authenticator': (0.115, 50 * 2**20)
+}
+# where to get usage samples from: 'metrics-api' for the k8s metrics API, or
+# 'fake' for made-up samples when testing without a metrics server
+METRICS_SOURCE = os.environ.get('METRICS_SOURCE', 'metrics-api')
+# the interval at which to collect usage samples of all sessions, in seconds
+USAGE_SAMPLE_INTERVAL = int(os.environ.get('USAGE_SAMPLE_INTERVAL', '60'))
+# the number of samples kept in each container's usage profile
+USAGE_PROFILE_MAX_SAMPLES = 1440
+# the number of samples needed before a container's usage profile is used to
+# size its resources
+USAGE_PROFILE_MIN_SAMPLES = 60
+# if session containers should get resources sized from their user's usage
+# profile when launched, rather than the defaults
+RIGHTSIZE_SESSION_RESOURCES = \
+    os.environ.get('RIGHTSIZE_SESSION_RESOURCES', 'False') == 'True'
+# right-sized requests are the 90th percentile of usage plus some headroom,
+# and right-sized limits are the 99th percentile of usage plus some more
+# headroom, both being kept within these fractions/multiples of the defaults;
+# limits are never lowered below the defaults, since usage profiles are mostly
+# made up of idle samples and a user's next job may need much more than usual
+RIGHTSIZE_REQUEST_HEADROOM = 1.2
+RIGHTSIZE_LIMIT_HEADROOM = 1.5
+RIGHTSIZE_MIN_FRACTION_OF_DEFAULT = 0.25
+RIGHTSIZE_MAX_MULTIPLE_OF_DEFAULT = 4
+# a container whose 95th percentile of usage is above this fraction of its
+# limit is reported as throttled (CPU) or at risk of being OOM-killed
+# (memory), and below this fraction of its request is reported as oversized
+THROTTLED_FRACTION_OF_LIMIT = 0.9
+OVERSIZED_FRACTION_OF_REQUEST = 0.3
+SESSION_USAGE_PROFILES_FILE_PATH = '/persistent_data/session_usage_profiles.pkl'
 
 APP_DIR = ''
 logger = None
 
+# the trace (if any) that is associated to the launch/deletion currently being
+# handled; a ContextVar is used so then each request/socketio background task
+# sees only its own trace
+current_trace = ContextVar('current_trace', default=None)
+# file that finished traces are appended to, one JSON object per line
+TRACE_FILE_PATH = None
+# for making sure that lines written to the trace file by concurrent requests
+# don't get interleaved
+trace_file_lock = Lock()
+# the size (in bytes) at which the trace file is rolled over to a backup file
+TRACE_FILE_MAX_BYTES = 10000000
+# the maximum number of traces that can be requested at once
+MAX_TRACES_PER_REQUEST = 100
+
+
+class TraceIdFilter(logging.Filter):
+    '''
+    Attach the ID of the current trace (if there is one) to every log record,
+    so then log lines can be matched up with the traces in the trace file
+    '''
+    def filter(self, record):
+        trace = current_trace.get()
+        record.trace_id = trace['trace_id'] if trace is not None else '-'
+        return True
+
 
 def setup_logger():
     formatter = logging.Formatter(
-        "[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s")
+        "[%(asctime)s] [trace=%(trace_id)s] {%(pathname)s:%(lineno)d} "
+        "%(levelname)s - %(message)s")
 
     if IN_CLUSTER == 'True':
         if not os.path.exists('/tmp/log'):
@@ -88,21 +273,166 @@ def setup_logger():
                                   backupCount=5)
     handler.setLevel(logging.INFO)
     handler.setFormatter(formatter)
+    handler.addFilter(TraceIdFilter())
     log = logging.getLogger('LAUNCHER')
     log.addHandler(handler)
     log.setLevel(logging.INFO)
     return log
 
 
+def get_trace_file_path():
+    '''
+    Get the path of the file that finished traces are exported to; it lives
+    alongside the launcher's log file
+    '''
+    if IN_CLUSTER == 'True':
+        return '/tmp/log/hebi-launcher-traces.jsonl'
+    else:
+        return os.path.join(APP_DIR, 'log/hebi-launcher-traces.jsonl')
+
+
+def traced(name):
+    '''
+    Decorator that creates a trace for every call of the decorated function
+    and exports it to the trace file once the function has returned
+
+    If the decorated function is called while a trace is already active (for
+    example, delete_hebi_k8s_resources() being called from within another
+    traced function), then no new trace is created and any spans are recorded
+    in the existing trace instead
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_trace.get() is not None:
+                return func(*args, **kwargs)
+
+            trace = {
+                'trace_id': uuid.uuid4().hex,
+                'name': name,
+                'fedid': kwargs.get('fedid', args[0] if args else None),
+                'start': time.time(),
+                'spans': []
+            }
+            token = current_trace.set(trace)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace['duration_ms'] = (time.perf_counter() - start) * 1000
+                current_trace.reset(token)
+                if not trace.get('is_discarded', False):
+                    export_trace(trace)
+        return wrapper
+    return decorator
+
+
+def discard_current_trace():
+    '''
+    Prevent the current trace from being exported, for calls of a traced
+    function that turned out to be too uninteresting to be worth keeping
+    '''
+    trace = current_trace.get()
+    if trace is not None:
+        trace['is_discarded'] = True
+
+
+def set_trace_fedid(fedid):
+    '''
+    Set the FedID of the user that the current trace is for, in the cases
+    where it isn't known until partway through a request (ie, after the JWT
+    has been decoded)
+    '''
+    trace = current_trace.get()
+    if trace is not None:
+        trace['fedid'] = fedid
+
+
+def add_span(name, start, duration_ms, **attributes):
+    '''
+    Add a child span to the current trace, where the start time (as a UNIX
+    timestamp) and duration of the span have already been measured
+    '''
+    trace = current_trace.get()
+    if trace is None:
+        return
+    trace['spans'].append({
+        'name': name,
+        'start': start,
+        'duration_ms': duration_ms,
+        'attributes': attributes
+    })
+
+
+@contextmanager
+def trace_span(name, **attributes):
+    '''
+    Time the enclosed block of code and record it as a child span of the
+    current trace
+    '''
+    start = time.time()
+    perf_start = time.perf_counter()
+    try:
+        yield attributes
+    except Exception as e:
+        attributes['error'] = str(e)
+        raise
+    finally:
+        add_span(name, start, (time.perf_counter() - perf_start) * 1000,
+                 **attributes)
+
+
+def export_trace(trace):
+    '''
+    Append a finished trace to the trace file as a single line of JSON
+    '''
+    try:
+        with trace_file_lock:
+            if os.path.exists(TRACE_FILE_PATH) and \
+                    os.path.getsize(TRACE_FILE_PATH) > TRACE_FILE_MAX_BYTES:
+                os.replace(TRACE_FILE_PATH, TRACE_FILE_PATH + '.1')
+            with open(TRACE_FILE_PATH, 'a') as f:
+                f.write(json.dumps(trace, default=str) + '\n')
+    except (OSError, TypeError) as e:
+        err_str = f"Failed to export trace {trace['trace_id']}: {str(e)}"
+        logger.error(err_str)
+        print(err_str)
+
+
+def get_traces_for_user(fedid, limit):
+    '''
+    Read the trace file and return the most recent traces for the given user
+
+    The file is read without holding trace_file_lock, so then exporting the
+    traces of launches isn't held up by reading the (possibly large) file;
+    this means that the last line may be only partially written, in which
+    case it's skipped
+    '''
+    traces = []
+    try:
+        with open(TRACE_FILE_PATH, 'r') as f:
+            for line in f:
+                try:
+                    trace = json.loads(line)
+                except ValueError:
+                    continue
+                if trace['fedid'] == fedid:
+                    traces.append(trace)
+    except FileNotFoundError:
+        pass
+    return traces[-limit:]
+
+
 def get_current_ingress_config():
     '''
     Form a python dict representing the current configuration of the Ingress
     that routes HTPP traffic for Hebi sessions
     '''
     # get Ingress details
-    ingress = k8s_api_networking_v1.list_namespaced_ingress(
-        namespace='hebi', pretty='true'
-    )
+    with trace_span('ingress_read'):
+        ingress = k8s_api_networking_v1.list_namespaced_ingress(
+            namespace='hebi', pretty='true'
+        )
 
     # get apiVersion
     if len(ingress.items[0].metadata.managed_fields) != 0:
@@ -182,10 +512,11 @@ def add_route_to_ingress(ingress_config, fedid):
 
     # add route to Ingress resource
     try:
-        patch = k8s_api_networking_v1.patch_namespaced_ingress(
-            'hebi-ingress', namespace, ingress_config, pretty='true',
-            field_manager=field_manager
-        )
+        with trace_span('ingress_patch', action='add_route'):
+            patch = k8s_api_networking_v1.patch_namespaced_ingress(
+                'hebi-ingress', namespace, ingress_config, pretty='true',
+                field_manager=field_manager
+            )
         logger.info(f"Ingress path added for {fedid}")
     except ApiException as ae:
         err_str = f"Exception when calling " \
@@ -241,10 +572,11 @@ def remove_route_from_ingress(ingress_config, fedid):
         # am unsure what it is (the alternative being to include everything in
         # a NetworkingV1Ingress object):
         # https://github.com/kubernetes-client/python/blob/master/kubernetes/docs/NetworkingV1Api.md#replace_namespaced_ingress
-        patch = k8s_api_networking_v1.patch_namespaced_ingress(
-            'hebi-ingress', namespace, ingress_config, pretty='true',
-            field_manager=field_manager
-        )
+        with trace_span('ingress_patch', action='remove_route'):
+            patch = k8s_api_networking_v1.patch_namespaced_ingress(
+                'hebi-ingress', namespace, ingress_config, pretty='true',
+                field_manager=field_manager
+            )
         logger.info(f"Ingress path removed for {fedid}")
     except ApiException as ae:
         err_str = f"Exception when calling " \
@@ -273,32 +605,39 @@ def get_user_ldap_info(fedid):
     group_search_attrs = ['memberUid']
     conn = Connection(ldap_server)
 
-    if conn.bind() is True:
+    with trace_span('ldap_bind'):
+        is_bound = conn.bind()
+
+    if is_bound is True:
         # get user's UID
-        uid_search_res = conn.search(uid_search_dn,
-            uid_search_filter,
-            attributes=uid_search_attrs)
+        with trace_span('ldap_search', query='uid'):
+            uid_search_res = conn.search(uid_search_dn,
+                uid_search_filter,
+                attributes=uid_search_attrs)
         user_info['uid'] = conn.entries[0]['uidNumber'].value
         user_info['is_uid_root'] = (user_info['uid'] == 0)
 
         # check if the user is a member of dls_staff
-        dls_staff_search_res = conn.search(group_search_dn,
-            '(cn=dls_staff)',
-            attributes=group_search_attrs)
+        with trace_span('ldap_search', query='dls_staff'):
+            dls_staff_search_res = conn.search(group_search_dn,
+                '(cn=dls_staff)',
+                attributes=group_search_attrs)
         user_info['is_dls_staff_member'] = \
             fedid in conn.entries[0]['memberUid'].value
 
         # check if the user is a member of dls_sysadmin
-        dls_sysadmin_search_res = conn.search(group_search_dn,
-            '(cn=dls_sysadmin)',
-            attributes=group_search_attrs)
+        with trace_span('ldap_search', query='dls_sysadmin'):
+            dls_sysadmin_search_res = conn.search(group_search_dn,
+                '(cn=dls_sysadmin)',
+                attributes=group_search_attrs)
         user_info['is_dls_sysadmin_member'] = \
             fedid in conn.entries[0]['memberUid'].value
 
         # check if the user is a member of functional_accounts
-        function_accounts_search_res = conn.search(group_search_dn,
-            '(cn=functional_accounts)',
-            attributes=group_search_attrs)
+        with trace_span('ldap_search', query='functional_accounts'):
+            function_accounts_search_res = conn.search(group_search_dn,
+                '(cn=functional_accounts)',
+                attributes=group_search_attrs)
         user_info['is_functional_accounts_member'] = \
             fedid in conn.entries[0]['memberUid'].value
     else:
@@ -372,6 +711,725 @@ def get_all_running_user_pods():
     return all_users_with_running_pods
 
 
+def get_user_from_pod(pod):
+    '''
+    Get the owner of a Hebi session Pod from its labels, or None if the Pod
+    isn't a Hebi session Pod (ie, it's the launcher's Pod)
+    '''
+    app_label = pod.metadata.labels.get('app', '') \
+        if pod.metadata.labels is not None else ''
+    if 'launcher' in app_label or not app_label.startswith('hebi-'):
+        return None
+    return app_label.split('-')[1]
+
+
+def get_session_pod_info(pod):
+    '''
+    Form a python dict with the info about a Hebi session Pod that is kept in
+    session_pods_index
+    '''
+    if pod.metadata.deletion_timestamp is not None:
+        # Pods that are in the process of shutting down still report their
+        # previous phase, so mark them as terminating instead
+        phase = 'Terminating'
+    else:
+        phase = pod.status.phase
+    resources = {}
+    for container in pod.spec.containers:
+        resources[container.name] = get_container_resources(container.resources)
+        if container.resources is not None and container.resources.limits:
+            limits = container.resources.limits
+            resources[container.name] += (
+                float(parse_quantity(limits['cpu'])) if 'cpu' in limits else None,
+                float(parse_quantity(limits['memory'])) if 'memory' in limits else None
+            )
+        else:
+            resources[container.name] += (None, None)
+    oom_killed_containers = []
+    for container_status in pod.status.container_statuses or []:
+        last_terminated = container_status.last_state.terminated \
+            if container_status.last_state is not None else None
+        if last_terminated is not None and last_terminated.reason == 'OOMKilled':
+            oom_killed_containers.append(container_status.name)
+    return {
+        'pod_name': pod.metadata.name,
+        'phase': phase,
+        'node': pod.spec.node_name,
+        'created': pod.metadata.creation_timestamp,
+        # {container name: (cpu request, memory request, cpu limit, memory
+        # limit)}
+        'resources': resources,
+        'oom_killed_containers': oom_killed_containers
+    }
+
+
+def refresh_session_pods_index():
+    '''
+    Periodically list all the Pods in the hebi namespace and rebuild
+    session_pods_index from them
+    '''
+    global session_pods_index, session_pods_index_updated
+
+    while True:
+        try:
+            all_pods = k8s_api_v1.list_namespaced_pod(namespace='hebi')
+            new_index = {}
+            for pod in all_pods.items:
+                user = get_user_from_pod(pod)
+                if user is None:
+                    continue
+                pod_info = get_session_pod_info(pod)
+                # a user can have more than one Pod (ie, the old Pod of a
+                # session that has been upgraded is still shutting down), in
+                # which case the Pod that isn't shutting down is the one that
+                # represents their session
+                if user not in new_index or \
+                        new_index[user]['phase'] == 'Terminating':
+                    new_index[user] = pod_info
+            with session_pods_index_lock:
+                old_index = session_pods_index
+                session_pods_index = new_index
+                session_pods_index_updated = datetime.now()
+            for user in set(old_index) | set(new_index):
+                old_phase = old_index[user]['phase'] if user in old_index else None
+                new_phase = new_index[user]['phase'] if user in new_index else None
+                if old_phase != new_phase:
+                    notify_session_state(user)
+        except ApiException as ae:
+            err_str = f"Failed to refresh the index of session Pods: {str(ae)}"
+            logger.error(err_str)
+            print(err_str)
+        socketio.sleep(SESSION_PODS_INDEX_REFRESH_INTERVAL)
+
+
+def get_container_resources(container_resources):
+    '''
+    Get the CPU (in cores) and memory (in bytes) requested by a container,
+    where container_resources is either a V1ResourceRequirements object or the
+    equivalent dict from a manifest
+
+    If a container has limits but no requests then k8s sets its requests to be
+    equal to its limits, so the limits are used in that case
+    '''
+    if container_resources is None:
+        return 0.0, 0.0
+    if isinstance(container_resources, dict):
+        requests = container_resources.get('requests')
+        limits = container_resources.get('limits')
+    else:
+        requests = container_resources.requests
+        limits = container_resources.limits
+    quantities = requests or limits or {}
+    cpu = float(parse_quantity(quantities['cpu'])) \
+        if 'cpu' in quantities else 0.0
+    memory = float(parse_quantity(quantities['memory'])) \
+        if 'memory' in quantities else 0.0
+    return cpu, memory
+
+
+def get_session_resource_requirements(deployment_doc):
+    '''
+    Get the total CPU and memory requested by all the containers in a rendered
+    session Deployment
+    '''
+    requirements = {
+        'cpu': 0.0,
+        'memory': 0.0
+    }
+    for container in deployment_doc['spec']['template']['spec']['containers']:
+        cpu, memory = get_container_resources(container.get('resources'))
+        requirements['cpu'] += cpu
+        requirements['memory'] += memory
+    return requirements
+
+
+def refresh_cluster_capacity():
+    '''
+    Periodically rebuild cluster_capacity from the nodes and Pods in the
+    cluster, and release the reservations of admitted sessions whose Pods have
+    now been scheduled onto a node
+    '''
+    global cluster_capacity, pending_eviction
+
+    while True:
+        try:
+            nodes = k8s_api_v1.list_node()
+            pods = k8s_api_v1.list_pod_for_all_namespaces(
+                field_selector='status.phase!=Succeeded,status.phase!=Failed')
+        except ApiException as ae:
+            err_str = f"Failed to refresh the cluster capacity: {str(ae)}"
+            logger.error(err_str)
+            print(err_str)
+            socketio.sleep(CLUSTER_CAPACITY_REFRESH_INTERVAL)
+            continue
+
+        new_capacity = {}
+        for node in nodes.items:
+            if node.spec.unschedulable:
+                continue
+            allocatable = node.status.allocatable or {}
+            new_capacity[node.metadata.name] = {
+                'allocatable_cpu': float(parse_quantity(allocatable.get('cpu', '0'))),
+                'allocatable_memory': float(parse_quantity(allocatable.get('memory', '0'))),
+                'requested_cpu': 0.0,
+                'requested_memory': 0.0
+            }
+
+        # the names of the scheduled Pods of each session, keyed by FedID
+        scheduled_pods = {}
+        present_users = set()
+        # the node and the resources requested by each scheduled session Pod,
+        # as {fedid: (node name, cpu, memory)}
+        session_pod_requests = {}
+        for pod in pods.items:
+            node_name = pod.spec.node_name
+            user = get_user_from_pod(pod) \
+                if pod.metadata.namespace == 'hebi' else None
+            if user is not None:
+                present_users.add(user)
+            if node_name is None:
+                continue
+            if user is not None:
+                scheduled_pods.setdefault(user, set()).add(pod.metadata.name)
+            if node_name not in new_capacity:
+                continue
+            pod_cpu = 0.0
+            pod_memory = 0.0
+            for container in pod.spec.containers:
+                cpu, memory = get_container_resources(container.resources)
+                pod_cpu += cpu
+                pod_memory += memory
+            new_capacity[node_name]['requested_cpu'] += pod_cpu
+            new_capacity[node_name]['requested_memory'] += pod_memory
+            if user is not None and pod.metadata.deletion_timestamp is None:
+                session_pod_requests[user] = (node_name, pod_cpu, pod_memory)
+
+        now = time.time()
+        with admission_lock:
+            cluster_capacity = new_capacity
+            for fedid in list(admission_reservations):
+                reservation = admission_reservations[fedid]
+                # a reservation made for upgrading a session is for the Pod
+                # that replaces the session's current Pod, so the current Pod
+                # being scheduled doesn't count
+                new_pods = scheduled_pods.get(fedid, set()) - \
+                    {reservation.get('replaces')}
+                if new_pods or \
+                        now - reservation['time'] > ADMISSION_RESERVATION_TIMEOUT:
+                    del admission_reservations[fedid]
+            # the evicted session's resources are no longer counted once its
+            # Pod has gone
+            if pending_eviction is not None and \
+                    (pending_eviction['fedid'] not in present_users or
+                     now - pending_eviction['time'] > ADMISSION_RESERVATION_TIMEOUT):
+                pending_eviction = None
+
+        if ADMISSION_EVICT_IDLE_SESSIONS:
+            evict_idle_session_for_queue(session_pod_requests)
+
+        socketio.sleep(CLUSTER_CAPACITY_REFRESH_INTERVAL)
+
+
+def get_pod_metrics_from_metrics_api():
+    '''
+    Get the current CPU (in cores) and memory (in bytes) usage of each
+    container in all the Pods in the hebi namespace from the metrics API, as
+    {pod name: {container name: (cpu, memory)}}
+    '''
+    pod_metrics = k8s_api_custom.list_namespaced_custom_object(
+        'metrics.k8s.io', 'v1beta1', 'hebi', 'pods')
+    usage = {}
+    for item in pod_metrics['items']:
+        try:
+            usage[item['metadata']['name']] = {
+                container['name']: (
+                    float(parse_quantity(container['usage']['cpu'])),
+                    float(parse_quantity(container['usage']['memory']))
+                )
+                for container in item['containers']
+            }
+        except (KeyError, TypeError, ValueError) as e:
+            # skip only the malformed item, rather than all the samples
+            logger.error(f"Skipping malformed Pod metrics item: {str(e)}")
+    return usage
+
+
+def get_pod_metrics_from_fake(pods_index):
+    '''
+    Make up the CPU and memory usage of each container in all session Pods, in
+    the same form as get_pod_metrics_from_metrics_api()
+
+    Each user is consistently a light, medium or heavy user (based on their
+    FedID), so then the resulting profiles differ between users
+    '''
+    usage = {}
+    for fedid, pod_info in pods_index.items():
+        weight = [0.2, 0.6, 1.3][int(hashlib.sha1(fedid.encode()).hexdigest(), 16) % 3]
+        usage[pod_info['pod_name']] = {
+            name: (cpu * weight * random.uniform(0.5, 1.0),
+                   memory * weight * random.uniform(0.8, 1.0))
+            for name, (cpu, memory) in DEFAULT_SESSION_CONTAINER_RESOURCES.items()
+        }
+    return usage
+
+
+def collect_session_usage_samples():
+    '''
+    Periodically get the resource usage of all running sessions, and add it to
+    the usage profiles of their users
+    '''
+    while True:
+        with session_pods_index_lock:
+            pods_index = session_pods_index
+        try:
+            if METRICS_SOURCE == 'fake':
+                usage = get_pod_metrics_from_fake(pods_index)
+            else:
+                usage = get_pod_metrics_from_metrics_api()
+        except Exception as e:
+            # catch everything (ie, connection errors as well as errors from
+            # the k8s API), otherwise this background task would stop
+            # collecting samples for good
+            err_str = f"Failed to get usage samples of sessions: {str(e)}"
+            logger.error(err_str)
+            print(err_str)
+            usage = {}
+
+        with session_usage_profiles_lock:
+            for fedid, pod_info in pods_index.items():
+                if pod_info['pod_name'] not in usage:
+                    continue
+                profile = session_usage_profiles.setdefault(fedid, {})
+                for name, sample in usage[pod_info['pod_name']].items():
+                    profile.setdefault(
+                        name, deque(maxlen=USAGE_PROFILE_MAX_SAMPLES)
+                    ).append(sample)
+
+        socketio.sleep(USAGE_SAMPLE_INTERVAL)
+
+
+def get_percentile(values, percentile):
+    '''
+    Get the given percentile (0-100) of a non-empty list of values
+    '''
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percentile / 100))
+    return values[index]
+
+
+def format_cpu_quantity(cpu):
+    '''
+    Format an amount of CPU (in cores) as a k8s quantity in millicores
+    '''
+    # round first so then floating point error doesn't push the value up by an
+    # extra millicore
+    return f"{math.ceil(round(cpu * 1000, 6))}m"
+
+
+def format_memory_quantity(memory):
+    '''
+    Format an amount of memory (in bytes) as a k8s quantity in mebibytes
+    '''
+    return f"{math.ceil(round(memory / 2**20, 6))}Mi"
+
+
+def get_session_container_resources(fedid):
+    '''
+    Get the CPU and memory requests and limits that each container in a user's
+    session should be launched with, as
+    {container name: {'requests': {...}, 'limits': {...}}} with the values
+    formatted as k8s quantities
+    '''
+    with session_usage_profiles_lock:
+        profile = {
+            name: list(samples)
+            for name, samples in session_usage_profiles.get(fedid, {}).items()
+        }
+
+    resources = {}
+    for name, (default_cpu, default_memory) in \
+            DEFAULT_SESSION_CONTAINER_RESOURCES.items():
+        samples = profile.get(name, [])
+        if not RIGHTSIZE_SESSION_RESOURCES or \
+                len(samples) < USAGE_PROFILE_MIN_SAMPLES:
+            request_cpu = limit_cpu = default_cpu
+            request_memory = limit_memory = default_memory
+        else:
+            sized = []
+            for values, default in [([cpu for cpu, _ in samples], default_cpu),
+                                    ([memory for _, memory in samples], default_memory)]:
+                lower = default * RIGHTSIZE_MIN_FRACTION_OF_DEFAULT
+                upper = default * RIGHTSIZE_MAX_MULTIPLE_OF_DEFAULT
+                request = get_percentile(values, 90) * RIGHTSIZE_REQUEST_HEADROOM
+                limit = get_percentile(values, 99) * RIGHTSIZE_LIMIT_HEADROOM
+                request = min(max(request, lower), upper)
+                limit = min(max(limit, request, default), upper)
+                sized.append((request, limit))
+            (request_cpu, limit_cpu), (request_memory, limit_memory) = sized
+        resources[name] = {
+            'requests': {
+                'cpu': format_cpu_quantity(request_cpu),
+                'memory': format_memory_quantity(request_memory)
+            },
+            'limits': {
+                'cpu': format_cpu_quantity(limit_cpu),
+                'memory': format_memory_quantity(limit_memory)
+            }
+        }
+    return resources
+
+
+def get_session_sizing_report():
+    '''
+    Compare the recent usage of each running session's containers against
+    their current requests/limits, and list the containers that are throttled
+    (or close to being OOM-killed) or oversized
+    '''
+    with session_pods_index_lock:
+        pods_index = session_pods_index
+    with session_usage_profiles_lock:
+        profiles = {
+            fedid: {name: list(samples)[-USAGE_PROFILE_MIN_SAMPLES:]
+                    for name, samples in profile.items()}
+            for fedid, profile in session_usage_profiles.items()
+        }
+
+    report = []
+    for fedid, pod_info in pods_index.items():
+        for name, (request_cpu, request_memory, limit_cpu, limit_memory) in \
+                pod_info['resources'].items():
+            samples = profiles.get(fedid, {}).get(name)
+            if not samples:
+                continue
+            cpu = get_percentile([cpu for cpu, _ in samples], 95)
+            memory = get_percentile([memory for _, memory in samples], 95)
+            problems = []
+            if limit_cpu and cpu >= limit_cpu * THROTTLED_FRACTION_OF_LIMIT:
+                problems.append('cpu_throttled')
+            if limit_memory and \
+                    memory >= limit_memory * THROTTLED_FRACTION_OF_LIMIT:
+                problems.append('memory_near_limit')
+            if name in pod_info['oom_killed_containers']:
+                problems.append('oom_killed')
+            if request_cpu and cpu < request_cpu * OVERSIZED_FRACTION_OF_REQUEST and \
+                    request_memory and \
+                    memory < request_memory * OVERSIZED_FRACTION_OF_REQUEST:
+                problems.append('oversized')
+            if problems:
+                report.append({
+                    'fedid': fedid,
+                    'container': name,
+                    'problems': problems,
+                    'p95_cpu': cpu,
+                    'p95_memory': memory,
+                    'request_cpu': request_cpu,
+                    'request_memory': request_memory,
+                    'limit_cpu': limit_cpu,
+                    'limit_memory': limit_memory
+                })
+    return report
+
+
+def write_session_usage_profiles_to_file():
+    '''
+    Periodically write the session_usage_profiles dict to file, so then users'
+    usage profiles persist over restarts of the launcher app
+    '''
+    while True:
+        with session_usage_profiles_lock:
+            profiles = {
+                fedid: {name: list(samples) for name, samples in profile.items()}
+                for fedid, profile in session_usage_profiles.items()
+            }
+        with open(SESSION_USAGE_PROFILES_FILE_PATH, 'wb') as f:
+            pickle.dump(profiles, f)
+        socketio.sleep(WRITE_SESSION_ACTIVITY_INTERVAL)
+
+
+def get_free_node_capacity():
+    '''
+    Get the CPU and memory that is free on each node, as
+    {node name: (cpu, memory)}, taking into account the resources reserved for
+    sessions that have been admitted but not yet scheduled
+
+    Must be called with admission_lock held
+    '''
+    reserved = {}
+    for reservation in admission_reservations.values():
+        node_reserved = reserved.setdefault(reservation['node'], [0.0, 0.0])
+        node_reserved[0] += reservation['cpu']
+        node_reserved[1] += reservation['memory']
+
+    free_capacity = {}
+    for node_name, node in cluster_capacity.items():
+        node_reserved = reserved.get(node_name, [0.0, 0.0])
+        free_capacity[node_name] = (
+            node['allocatable_cpu'] - node['requested_cpu'] - node_reserved[0],
+            node['allocatable_memory'] - node['requested_memory'] -
+            node_reserved[1]
+        )
+    return free_capacity
+
+
+def find_node_with_capacity(requirements):
+    '''
+    Find the node with the least free CPU that can still fit a session with the
+    given resource requirements
+
+    Must be called with admission_lock held
+    '''
+    best_node = None
+    best_free_cpu = None
+    for node_name, (free_cpu, free_memory) in get_free_node_capacity().items():
+        if free_cpu >= requirements['cpu'] and \
+                free_memory >= requirements['memory']:
+            if best_free_cpu is None or free_cpu < best_free_cpu:
+                best_node = node_name
+                best_free_cpu = free_cpu
+    return best_node
+
+
+def estimate_queue_wait_seconds(queue_position):
+    '''
+    Estimate how long the user at the given (1-based) position in
+    admission_queue will need to wait, by assuming that each running session
+    that expires due to inactivity frees up enough room for one queued session
+    '''
+    sessions_activity = dict(all_sessions_activity)
+    now = datetime.now()
+    inactivity_period = get_session_inactivity_period_seconds()
+    seconds_until_expiries = sorted(
+        max(0, inactivity_period - int((now - last_active).total_seconds()))
+        for last_active in sessions_activity.values()
+    )
+    if len(seconds_until_expiries) < queue_position:
+        return None
+    return seconds_until_expiries[queue_position - 1]
+
+
+def request_admission(fedid, requirements):
+    '''
+    Decide if a session with the given resource requirements can be launched
+    for the user now, or if they need to wait in admission_queue
+
+    Users are admitted in the order that they joined the queue: a user who
+    isn't at the front of the queue is never admitted ahead of the user at the
+    front, even if their session would fit
+    '''
+    now = time.time()
+    with admission_lock:
+        # remove users who have stopped polling to see if they've been admitted
+        admission_queue[:] = [
+            entry for entry in admission_queue
+            if now - entry['last_seen'] <= ADMISSION_QUEUE_ENTRY_TIMEOUT
+        ]
+        queued_fedids = [entry['fedid'] for entry in admission_queue]
+
+        if not cluster_capacity:
+            # no view of the cluster's capacity yet (or the nodes couldn't be
+            # listed), so don't prevent launches
+            node = None
+        elif queued_fedids and queued_fedids[0] != fedid:
+            node = None
+        else:
+            node = find_node_with_capacity(requirements)
+
+        if not cluster_capacity or node is not None:
+            if queued_fedids and queued_fedids[0] == fedid:
+                admission_queue.pop(0)
+            if node is not None:
+                admission_reservations[fedid] = {
+                    'node': node,
+                    'cpu': requirements['cpu'],
+                    'memory': requirements['memory'],
+                    'time': now
+                }
+            return {
+                'admitted': True
+            }
+
+        if fedid in queued_fedids:
+            queue_position = queued_fedids.index(fedid) + 1
+            admission_queue[queue_position - 1]['last_seen'] = now
+            admission_queue[queue_position - 1]['requirements'] = requirements
+        else:
+            admission_queue.append({
+                'fedid': fedid,
+                'enqueued': now,
+                'last_seen': now,
+                'requirements': requirements
+            })
+            queue_position = len(admission_queue)
+            logger.info(f"Not enough capacity to launch {fedid}'s Hebi "
+                        f"session, queued at position {queue_position}")
+
+    return {
+        'admitted': False,
+        'queue_position': queue_position,
+        'estimated_wait_seconds': estimate_queue_wait_seconds(queue_position)
+    }
+
+
+def get_queued_requirements(fedid):
+    '''
+    Get the resource requirements of the session that a user is waiting in
+    admission_queue to launch, or None if they're not in the queue
+    '''
+    with admission_lock:
+        for entry in admission_queue:
+            if entry['fedid'] == fedid:
+                return entry['requirements']
+    return None
+
+
+def release_admission(fedid):
+    '''
+    Release the resources reserved for a user's session when it was admitted,
+    for when the session ends up not being launched after all
+    '''
+    with admission_lock:
+        admission_reservations.pop(fedid, None)
+
+
+def get_queued_response(fedid, admission):
+    '''
+    Form the response to a request to start_hebi() from a user who has to wait
+    in admission_queue
+    '''
+    return {
+        'username': fedid,
+        'was_session_launched': False,
+        'is_queued': True,
+        'queue_position': admission['queue_position'],
+        'estimated_wait_seconds': admission['estimated_wait_seconds'],
+        'message': 'waiting for cluster capacity'
+    }
+
+
+def evict_idle_session_for_queue(session_pod_requests):
+    '''
+    If the user at the front of admission_queue can't be admitted, shutdown
+    the session that has been idle for the longest (if it has been idle for
+    longer than ADMISSION_EVICT_IDLE_AFTER_SECONDS) out of the sessions whose
+    removal would make enough room for them on their node
+
+    session_pod_requests is {fedid: (node name, cpu, memory)} for all
+    scheduled session Pods. Nothing is shutdown while a previous early
+    shutdown is still pending
+    '''
+    global pending_eviction
+
+    now = datetime.now()
+    sessions_activity = dict(all_sessions_activity)
+
+    with admission_lock:
+        if not admission_queue or pending_eviction is not None:
+            return
+        queued_fedids = [entry['fedid'] for entry in admission_queue]
+        requirements = admission_queue[0]['requirements']
+        if find_node_with_capacity(requirements) is not None:
+            # the user at the front will be admitted the next time that they
+            # poll, so there's no need to shutdown anything
+            return
+
+        free_capacity = get_free_node_capacity()
+        candidates = []
+        for fedid, (node_name, cpu, memory) in session_pod_requests.items():
+            last_active = sessions_activity.get(fedid)
+            if fedid in queued_fedids or last_active is None or \
+                    (now - last_active).total_seconds() <= \
+                    ADMISSION_EVICT_IDLE_AFTER_SECONDS or \
+                    node_name not in free_capacity:
+                continue
+            free_cpu, free_memory = free_capacity[node_name]
+            if free_cpu + cpu >= requirements['cpu'] and \
+                    free_memory + memory >= requirements['memory']:
+                candidates.append((last_active, fedid, node_name, cpu, memory))
+        if not candidates:
+            return
+
+        last_active, fedid, node_name, cpu, memory = min(candidates)
+        pending_eviction = {
+            'fedid': fedid,
+            'node': node_name,
+            'cpu': cpu,
+            'memory': memory,
+            'time': time.time()
+        }
+
+    logger.info(f"Shutting down {fedid}'s Hebi session early, since it has "
+                f"been inactive since {last_active} and {queued_fedids[0]} is "
+                f"waiting for cluster capacity on {node_name}")
+    thread_lock.acquire()
+    try:
+        log_session_stop = delete_hebi_k8s_resources(fedid)
+    finally:
+        thread_lock.release()
+    if not log_session_stop['was_session_stopped']:
+        with admission_lock:
+            pending_eviction = None
+
+
+def set_session_pods_index_entry(fedid, pod_info):
+    '''
+    Update the entry for a user's session in session_pods_index straight away
+    (rather than waiting for the next refresh), where pod_info being None
+    means that the session no longer exists
+    '''
+    global session_pods_index
+
+    with session_pods_index_lock:
+        # replace the dict rather than modifying it, since readers take a
+        # reference to it and then iterate over it without holding the lock
+        new_index = dict(session_pods_index)
+        if pod_info is None:
+            new_index.pop(fedid, None)
+        else:
+            new_index[fedid] = pod_info
+        session_pods_index = new_index
+    notify_session_state(fedid)
+
+
+def is_session_running(fedid):
+    '''
+    Determine if a user has a Hebi session, using session_pods_index if it has
+    been populated
+    '''
+    with session_pods_index_lock:
+        if session_pods_index_updated is not None:
+            pod_info = session_pods_index.get(fedid)
+            return pod_info is not None and pod_info['phase'] != 'Terminating'
+    return fedid in get_all_running_user_pods()
+
+
+def get_session_state(fedid):
+    '''
+    Form the python dict that describes the state of a user's session, as
+    given by the session_info view and the session-state socketio event
+    '''
+    return {
+        'username': fedid,
+        'is_session_currently_running': is_session_running(fedid)
+    }
+
+
+def notify_session_state(fedid):
+    '''
+    Send the current state of a user's session to any launcher web app pages
+    that have subscribed to changes in it
+    '''
+    socketio.emit('session-state', get_session_state(fedid),
+                  room='session-state-' + fedid)
+
+
+def get_session_inactivity_period_seconds():
+    '''
+    Get the period of inactivity after which a session is shutdown, in seconds
+    '''
+    return SESSION_INACTIVITY_PERIOD_HRS * 60 * 60 + \
+        SESSION_INACTIVITY_PERIOD_DAYS * 60 * 60 * 24
+
+
 def check_if_pod_is_active(fedid):
     '''
     Check the timestamp of the last time that the user's session responded to a
@@ -381,8 +1439,7 @@ def check_if_pod_is_active(fedid):
     current_time = datetime.now()
     difference = current_time - last_response
     if difference.seconds + difference.days * 60 * 60 * 24 < \
-            SESSION_INACTIVITY_PERIOD_HRS * 60 * 60 + \
-            SESSION_INACTIVITY_PERIOD_DAYS * 60 * 60 * 24:
+            get_session_inactivity_period_seconds():
         return True
     else:
         return False
@@ -424,6 +1481,549 @@ def check_for_inactive_sessions():
         socketio.sleep(INACTIVE_SESSION_CHECK_INTERVAL)
 
 
+def require_admin():
+    '''
+    Abort the current request if the user making it isn't an admin
+    '''
+    if request.headers.get('X-Username') is None and \
+            request.cookies.get('token') is None:
+        abort(403)
+    try:
+        fedid = get_fedid_from_request()
+    except (jwt.InvalidTokenError, KeyError):
+        abort(403)
+    if fedid not in ADMIN_FEDIDS:
+        abort(403)
+
+
+def get_csrf_token():
+    '''
+    Get the CSRF token for the current request's token cookie, which is an
+    HMAC of the cookie, so then only a page that can read responses from the
+    launcher can know it
+    '''
+    cookie = request.cookies.get('token')
+    if cookie is None:
+        abort(403)
+    return hmac.new(os.environ['JWT_KEY'].encode(), cookie.encode(),
+                    hashlib.sha256).hexdigest()
+
+
+def require_csrf_token():
+    '''
+    Abort the current request if it doesn't have the CSRF token for its token
+    cookie in the X-CSRF-Token header, since a cross-site request would still
+    have the cookie sent with it by the browser but can't set the header
+    '''
+    if not hmac.compare_digest(request.headers.get('X-CSRF-Token', ''),
+                               get_csrf_token()):
+        abort(403)
+
+
+@app.route('/k8s/admin/csrf_token')
+def get_admin_csrf_token():
+    '''
+    Get the CSRF token that admin operations which change things must be sent
+    with
+    '''
+    require_admin()
+    return json.dumps({'csrf_token': get_csrf_token()})
+
+
+def get_session_inventory():
+    '''
+    Form a list of rows describing every Hebi session, using only
+    session_pods_index and all_sessions_activity
+    '''
+    with session_pods_index_lock:
+        pods_index = session_pods_index
+    # copying the dict is atomic, so there's no need to wait on thread_lock
+    # (which can be held for the duration of a session deletion) just to read
+    # it
+    sessions_activity = dict(all_sessions_activity)
+
+    now = datetime.now()
+    inactivity_period = get_session_inactivity_period_seconds()
+    rows = []
+    for fedid, pod_info in pods_index.items():
+        last_active = sessions_activity.get(fedid)
+        if last_active is not None:
+            seconds_until_expiry = max(
+                0, inactivity_period - int((now - last_active).total_seconds()))
+        else:
+            seconds_until_expiry = None
+        rows.append({
+            'fedid': fedid,
+            'phase': pod_info['phase'],
+            'node': pod_info['node'],
+            'created': pod_info['created'],
+            'last_active': last_active,
+            'seconds_until_expiry': seconds_until_expiry
+        })
+    return rows
+
+
+def serialise_session_inventory_row(row):
+    '''
+    Convert the timestamps in a row of the session inventory to strings, so
+    then it can be serialised to JSON
+    '''
+    serialised_row = dict(row)
+    for key in ['created', 'last_active']:
+        if serialised_row[key] is not None:
+            serialised_row[key] = serialised_row[key].isoformat()
+    return serialised_row
+
+
+@app.route('/k8s/admin/sessions')
+def get_admin_session_inventory():
+    '''
+    Get a paginated and sortable list of all Hebi sessions, along with some
+    aggregate counts across all sessions
+    '''
+    require_admin()
+    data = request.args.to_dict()
+
+    try:
+        page = max(1, int(data.get('page', 1)))
+        per_page = min(MAX_SESSIONS_PER_PAGE,
+                       max(1, int(data.get('per_page', 50))))
+    except ValueError:
+        abort(400)
+    sort = data.get('sort', 'fedid')
+    if sort not in SESSION_INVENTORY_SORT_FIELDS:
+        abort(400)
+    reverse = data.get('order', 'asc') == 'desc'
+
+    rows = get_session_inventory()
+    # sessions without a value for the sort field always go last
+    rows_with_value = [row for row in rows if row[sort] is not None]
+    rows_without_value = [row for row in rows if row[sort] is None]
+    rows_with_value.sort(key=lambda row: row[sort], reverse=reverse)
+    rows = rows_with_value + rows_without_value
+
+    phase_counts = {}
+    for row in rows:
+        phase_counts[row['phase']] = phase_counts.get(row['phase'], 0) + 1
+
+    start = (page - 1) * per_page
+    resp = {
+        'page': page,
+        'per_page': per_page,
+        'total': len(rows),
+        'counts': {
+            'phase': phase_counts,
+            'without_heartbeat': len(
+                [row for row in rows if row['last_active'] is None])
+        },
+        'index_updated': session_pods_index_updated.isoformat()
+            if session_pods_index_updated is not None else None,
+        'sessions': [serialise_session_inventory_row(row)
+                     for row in rows[start:start + per_page]]
+    }
+    return json.dumps(resp)
+
+
+@app.route('/k8s/admin/sessions/export')
+def export_admin_session_inventory():
+    '''
+    Stream every row of the session inventory as newline-delimited JSON
+    '''
+    require_admin()
+    rows = get_session_inventory()
+
+    def generate():
+        for row in rows:
+            yield json.dumps(serialise_session_inventory_row(row)) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+def get_upgrade_image_patch(images, node):
+    '''
+    Form the strategic merge patch that changes the images of the given
+    containers in a session's Deployment
+
+    The new Pod is pinned to the node that the session is currently on, so
+    then only the node being upgraded pulls the new images, and the
+    Deployment's strategy is changed to Recreate, so then the new Pod reuses
+    the resources of the old Pod rather than needing room alongside it. Note
+    that the pin stays on the Deployment after the upgrade
+    '''
+    pod_spec = {
+        'containers': [
+            {'name': name, 'image': image}
+            for name, image in images.items()
+        ]
+    }
+    if node is not None:
+        pod_spec['affinity'] = {
+            'nodeAffinity': {
+                'requiredDuringSchedulingIgnoredDuringExecution': {
+                    'nodeSelectorTerms': [{
+                        'matchFields': [{
+                            'key': 'metadata.name',
+                            'operator': 'In',
+                            'values': [node]
+                        }]
+                    }]
+                }
+            }
+        }
+    return {
+        'spec': {
+            'strategy': {
+                'type': 'Recreate',
+                'rollingUpdate': None
+            },
+            'template': {
+                'spec': pod_spec
+            }
+        }
+    }
+
+
+def reserve_capacity_for_upgrade(fedid):
+    '''
+    Reserve the resources of a session's current Pod on its node for the Pod
+    that will replace it when upgraded, so then a queued launch can't be
+    admitted into the room that the old Pod leaves when it's shutdown
+
+    Returns the node that the session's Pod is on, or None if it isn't
+    scheduled
+    '''
+    with session_pods_index_lock:
+        pod_info = session_pods_index.get(fedid)
+    if pod_info is None or pod_info['node'] is None:
+        return None
+
+    cpu = sum(resources[0] for resources in pod_info['resources'].values())
+    memory = sum(resources[1] for resources in pod_info['resources'].values())
+    with admission_lock:
+        admission_reservations[fedid] = {
+            'node': pod_info['node'],
+            'cpu': cpu,
+            'memory': memory,
+            'time': time.time(),
+            'replaces': pod_info['pod_name']
+        }
+    return pod_info['node']
+
+
+def check_upgraded_session_health(fedid, images, patched_time):
+    '''
+    Check the health of a session that has been patched to use new images,
+    returning one of the following statuses along with some detail:
+    - 'done' if the session has exactly one Pod, which is using the new images
+      and whose containers are all ready
+    - 'gone' if the session's Deployment no longer exists (ie, the session has
+      been shutdown since being patched)
+    - 'upgrading' otherwise
+
+    A heartbeat since the session was patched isn't enough by itself, since
+    the old Pod keeps serving the session until the new Pod is ready, so it
+    only adds to the detail of a session whose new Pod is ready
+    '''
+    user_pods = k8s_api_v1.list_namespaced_pod(
+        namespace='hebi',
+        label_selector='app={}'.format('hebi-' + fedid))
+    pods = [pod for pod in user_pods.items
+            if pod.metadata.deletion_timestamp is None]
+    if len(pods) == 0:
+        try:
+            k8s_apps_v1.read_namespaced_deployment('hebi-' + fedid, 'hebi')
+        except ApiException as ae:
+            if ae.status == 404:
+                return 'gone', 'session was shutdown during the upgrade'
+            raise
+    if len(pods) != 1:
+        return 'upgrading', f"{len(pods)} Pods present"
+
+    pod = pods[0]
+    for container in pod.spec.containers:
+        if container.name in images and container.image != images[container.name]:
+            return 'upgrading', 'Pod with new images not yet created'
+    if pod.status.phase != 'Running' or not pod.status.container_statuses:
+        return 'upgrading', f"Pod is {pod.status.phase}"
+    for container_status in pod.status.container_statuses:
+        if not container_status.ready:
+            return 'upgrading', f"container {container_status.name} is not ready"
+
+    last_active = all_sessions_activity.get(fedid)
+    if last_active is not None and last_active > patched_time:
+        return 'done', 'Pod with new images is ready, heartbeat received ' \
+                       'since upgrade'
+    return 'done', 'Pod with new images is ready'
+
+
+def update_session_upgrade_status(fedid, status, detail=None):
+    '''
+    Record the progress of a session in the current rolling upgrade
+    '''
+    with session_upgrade_lock:
+        session_upgrade['sessions'][fedid]['status'] = status
+        session_upgrade['sessions'][fedid]['detail'] = detail
+
+
+def run_session_upgrade(images, max_concurrent, active_within_seconds):
+    '''
+    Patch the Deployments of running sessions to use new images, going through
+    the nodes one at a time so then only one node is pulling the new images at
+    any given moment, and upgrading at most max_concurrent sessions at a time
+
+    Sessions that have responded to a heartbeat-request within the last
+    active_within_seconds are in use, so they're skipped. Each batch of
+    upgraded sessions must become healthy before the next batch is started,
+    otherwise the upgrade is halted. Sessions that are shutdown part way
+    through the upgrade are marked as gone and don't halt it
+    '''
+    try:
+        upgrade_running_sessions(images, max_concurrent, active_within_seconds)
+    finally:
+        # make sure that the upgrade never stays as running if it has stopped
+        # for some unexpected reason, otherwise no other upgrade could be
+        # started until the launcher is restarted
+        with session_upgrade_lock:
+            if session_upgrade['state'] == 'running':
+                session_upgrade['state'] = 'halted'
+                session_upgrade['finished'] = datetime.now()
+                logger.error('Upgrade of running sessions stopped unexpectedly')
+
+
+def upgrade_running_sessions(images, max_concurrent, active_within_seconds):
+    '''
+    Perform the rolling upgrade described in run_session_upgrade()
+    '''
+    with session_upgrade_lock:
+        nodes = session_upgrade['nodes']
+
+    for node in nodes:
+        with session_upgrade_lock:
+            session_upgrade['current_node'] = node
+            node_sessions = [
+                fedid for fedid, session in session_upgrade['sessions'].items()
+                if session['node'] == node
+            ]
+
+        # decide which sessions on this node are in use just before starting
+        # on the node, rather than when the upgrade was first requested
+        now = datetime.now()
+        sessions_to_upgrade = []
+        for fedid in node_sessions:
+            last_active = all_sessions_activity.get(fedid)
+            if last_active is not None and \
+                    (now - last_active).total_seconds() < active_within_seconds:
+                update_session_upgrade_status(fedid, 'skipped',
+                                              f"active at {last_active}")
+            else:
+                sessions_to_upgrade.append(fedid)
+
+        for i in range(0, len(sessions_to_upgrade), max_concurrent):
+            batch = sessions_to_upgrade[i:i + max_concurrent]
+            patched_times = {}
+            for fedid in batch:
+                pod_node = reserve_capacity_for_upgrade(fedid)
+                try:
+                    k8s_apps_v1.patch_namespaced_deployment(
+                        'hebi-' + fedid, 'hebi',
+                        get_upgrade_image_patch(images, pod_node),
+                        field_manager='hebi-launcher'
+                    )
+                    patched_times[fedid] = datetime.now()
+                    update_session_upgrade_status(fedid, 'upgrading')
+                    logger.info(f"Deployment patched with new images for {fedid}: {images}")
+                except ApiException as ae:
+                    release_admission(fedid)
+                    if ae.status == 404:
+                        # the session has been shutdown since the upgrade was
+                        # started, so there's nothing to upgrade
+                        update_session_upgrade_status(
+                            fedid, 'gone', 'session was shutdown before upgrade')
+                        continue
+                    err_str = f"Something went wrong with upgrading the " \
+                              f"images of {fedid}'s Hebi session: {str(ae)}"
+                    logger.error(err_str)
+                    print(err_str)
+                    update_session_upgrade_status(fedid, 'failed', str(ae))
+
+            start = time.time()
+            waiting = list(patched_times)
+            while waiting:
+                socketio.sleep(UPGRADE_HEALTH_CHECK_INTERVAL)
+                for fedid in list(waiting):
+                    try:
+                        status, detail = check_upgraded_session_health(
+                            fedid, images, patched_times[fedid])
+                    except ApiException as ae:
+                        status, detail = 'upgrading', str(ae)
+                    if status in ['done', 'gone']:
+                        update_session_upgrade_status(fedid, status, detail)
+                        waiting.remove(fedid)
+                        if status == 'gone':
+                            release_admission(fedid)
+                    elif time.time() - start > UPGRADE_HEALTH_TIMEOUT:
+                        update_session_upgrade_status(fedid, 'failed', detail)
+                        waiting.remove(fedid)
+                        release_admission(fedid)
+                    else:
+                        update_session_upgrade_status(fedid, 'upgrading', detail)
+
+            with session_upgrade_lock:
+                failed = [fedid for fedid in batch
+                          if session_upgrade['sessions'][fedid]['status'] == 'failed']
+                if failed:
+                    session_upgrade['state'] = 'halted'
+                    session_upgrade['finished'] = datetime.now()
+            if failed:
+                logger.error(f"Halting the upgrade of running sessions, since "
+                             f"the upgrades of these sessions failed: {failed}")
+                return
+
+    with session_upgrade_lock:
+        session_upgrade['state'] = 'completed'
+        session_upgrade['current_node'] = None
+        session_upgrade['finished'] = datetime.now()
+    logger.info('Upgrade of running sessions has completed')
+
+
+def get_session_upgrade_progress():
+    '''
+    Form a python dict summarising the progress of the current (or most
+    recent) rolling upgrade
+    '''
+    with session_upgrade_lock:
+        if session_upgrade is None:
+            return None
+        counts = {}
+        for session in session_upgrade['sessions'].values():
+            counts[session['status']] = counts.get(session['status'], 0) + 1
+        return {
+            'state': session_upgrade['state'],
+            'images': session_upgrade['images'],
+            'max_concurrent': session_upgrade['max_concurrent'],
+            'active_within_seconds': session_upgrade['active_within_seconds'],
+            'started': session_upgrade['started'].isoformat(),
+            'finished': session_upgrade['finished'].isoformat()
+                if session_upgrade['finished'] is not None else None,
+            'nodes': session_upgrade['nodes'],
+            'current_node': session_upgrade['current_node'],
+            'counts': counts,
+            'sessions': {
+                fedid: dict(session)
+                for fedid, session in session_upgrade['sessions'].items()
+            }
+        }
+
+
+@app.route('/k8s/admin/sizing')
+def get_admin_session_sizing_report():
+    '''
+    Get the session containers that are throttled or oversized, along with
+    the resources that each listed user's session would get if launched now
+    '''
+    require_admin()
+    report = get_session_sizing_report()
+    resp = {
+        'rightsizing_enabled': RIGHTSIZE_SESSION_RESOURCES,
+        'metrics_source': METRICS_SOURCE,
+        'containers': report,
+        'suggested_resources': {
+            fedid: get_session_container_resources(fedid)
+            for fedid in set(row['fedid'] for row in report)
+        }
+    }
+    return json.dumps(resp)
+
+
+@app.route('/k8s/admin/upgrade', methods=['POST'])
+def start_session_upgrade():
+    '''
+    Start a rolling upgrade of the running sessions to new images, where the
+    JSON body of the request has the new image for each container to be
+    upgraded keyed by the container's name (for example,
+    {"images": {"api": <image>}, "max_concurrent": 2}), and the X-CSRF-Token
+    header has the token from /k8s/admin/csrf_token
+    '''
+    global session_upgrade
+
+    require_admin()
+    require_csrf_token()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400)
+    try:
+        max_concurrent = max(1, int(data.get(
+            'max_concurrent', DEFAULT_UPGRADE_MAX_CONCURRENT)))
+        active_within_seconds = int(data.get(
+            'active_within_seconds', DEFAULT_UPGRADE_ACTIVE_WITHIN_SECONDS))
+    except (TypeError, ValueError):
+        abort(400)
+    images = data.get('images')
+    if not isinstance(images, dict) or not images or \
+            any(name not in SESSION_CONTAINER_NAMES for name in images):
+        abort(400)
+    for image in images.values():
+        if not isinstance(image, str) or any(c.isspace() for c in image) or \
+                not any(image.startswith(prefix)
+                        for prefix in ALLOWED_SESSION_IMAGE_PREFIXES):
+            abort(400)
+
+    with session_pods_index_lock:
+        pods_index = session_pods_index
+
+    with session_upgrade_lock:
+        if session_upgrade is not None and session_upgrade['state'] == 'running':
+            return json.dumps({
+                'was_upgrade_started': False,
+                'message': 'an upgrade is already running'
+            })
+        sessions = {
+            fedid: {
+                'node': pod_info['node'],
+                'status': 'pending',
+                'detail': None
+            }
+            for fedid, pod_info in pods_index.items()
+            if pod_info['phase'] != 'Terminating'
+        }
+        session_upgrade = {
+            'state': 'running',
+            'images': images,
+            'max_concurrent': max_concurrent,
+            'active_within_seconds': active_within_seconds,
+            'started': datetime.now(),
+            'finished': None,
+            'nodes': sorted(set(str(session['node'])
+                                for session in sessions.values())),
+            'current_node': None,
+            'sessions': sessions
+        }
+        # sessions that haven't been scheduled yet are grouped under the node
+        # 'None'
+        for session in sessions.values():
+            session['node'] = str(session['node'])
+
+    logger.info(f"Starting upgrade of {len(sessions)} running sessions to "
+                f"images {images}")
+    socketio.start_background_task(run_session_upgrade, images,
+                                   max_concurrent, active_within_seconds)
+
+    return json.dumps({
+        'was_upgrade_started': True,
+        'progress': get_session_upgrade_progress()
+    })
+
+
+@app.route('/k8s/admin/upgrade/status')
+def get_session_upgrade_status():
+    '''
+    Get the progress of the current (or most recent) rolling upgrade of
+    running sessions
+    '''
+    require_admin()
+    return json.dumps(get_session_upgrade_progress())
+
+
 def write_session_activity_to_file():
     """
     Periodically write the `all_sessions_activity` dict to file, so then its
@@ -437,29 +2037,78 @@ def write_session_activity_to_file():
         socketio.sleep(WRITE_SESSION_ACTIVITY_INTERVAL)
 
 
+def decode_token(token):
+    '''
+    Decode a JWT from a browser cookie, reusing the payload of a previous
+    decoding of the same token if there is one
+
+    Tokens with an expiry are decoded again once they have expired, so then
+    jwt raises the appropriate error
+    '''
+    with decoded_token_cache_lock:
+        payload = decoded_token_cache.get(token)
+        if payload is not None:
+            if 'exp' not in payload or payload['exp'] > time.time():
+                decoded_token_cache.move_to_end(token)
+                return payload
+            del decoded_token_cache[token]
+
+    with trace_span('jwt_decode'):
+        payload = jwt.decode(token, os.environ['JWT_KEY'], algorithms=[JWT_ALGORITHM])
+
+    with decoded_token_cache_lock:
+        decoded_token_cache[token] = payload
+        if len(decoded_token_cache) > DECODED_TOKEN_CACHE_SIZE:
+            decoded_token_cache.popitem(last=False)
+    return payload
+
+
+def get_fedid_from_request():
+    '''
+    Get the FedID of the user making the current request
+
+    nginx passes on the username that cas-auth resolved from the token cookie
+    in the X-Username header (overwriting any value sent by the client), so the
+    token only needs to be decoded here if the request didn't come via nginx
+    '''
+    fedid = request.headers.get('X-Username')
+    if fedid:
+        return fedid
+    return decode_token(request.cookies.get('token'))['username']
+
+
+@socketio.on('subscribe-session-state')
+def subscribe_session_state(data):
+    '''
+    Subscribe the launcher web app page that sent this event to changes in the
+    state of its user's session, and send it the current state
+    '''
+    try:
+        fedid = decode_token(request.cookies.get('token'))['username']
+    except (jwt.InvalidTokenError, KeyError):
+        return
+    join_room('session-state-' + fedid)
+    emit('session-state', get_session_state(fedid))
+
+
 @app.route('/k8s/session_info')
 def get_user_session_info():
     '''
     Determine if the user who has visited the launcher web app has a Hebi
     session already running or not
-    '''
-    cookie = request.cookies.get('token')
-    payload = jwt.decode(cookie, os.environ['JWT_KEY'], algorithms=[JWT_ALGORITHM])
-    fedid = payload['username']
-    resp = {
-        'username': fedid        
-    }
-    all_users_with_running_pods = get_all_running_user_pods()
 
-    if fedid in all_users_with_running_pods:
-        resp['is_session_currently_running'] = True
-    else:
-        resp['is_session_currently_running'] = False
-
-    return json.dumps(resp)
+    The response has an ETag, so then if the answer hasn't changed since the
+    browser last asked, a 304 is returned instead
+    '''
+    fedid = get_fedid_from_request()
+    resp = app.response_class(json.dumps(get_session_state(fedid)))
+    resp.set_etag(hashlib.sha1(resp.get_data()).hexdigest())
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request)
 
 
 @app.route('/k8s/start_hebi')
+@traced('start_hebi')
 def start_hebi():
     '''
     Create the required k8s resources for the user requesting to run Hebi
@@ -470,11 +2119,22 @@ def start_hebi():
     # check if FedID is in the request or not; if not, it's in the cookie in
     # the web browser
     if 'fedid' not in data:
-        cookie = request.cookies.get('token')
-        payload = jwt.decode(cookie, os.environ['JWT_KEY'], algorithms=[JWT_ALGORITHM])
-        fedid = payload['username']
+        fedid = get_fedid_from_request()
     else:
         fedid = data['fedid']
+    set_trace_fedid(fedid)
+
+    # users who are waiting in admission_queue poll this view until they're
+    # admitted, so check if they can be admitted yet before repeating the LDAP
+    # queries and k8s checks below, which would otherwise be done most often
+    # exactly when the cluster is full
+    admission = None
+    queued_requirements = get_queued_requirements(fedid)
+    if queued_requirements is not None:
+        admission = request_admission(fedid, queued_requirements)
+        if not admission['admitted']:
+            discard_current_trace()
+            return json.dumps(get_queued_response(fedid, admission))
 
     user_ldap_info = get_user_ldap_info(fedid)
     logger.info(f"LDAP info for {fedid}: {user_ldap_info}")
@@ -489,6 +2149,7 @@ def start_hebi():
     if not is_valid_user:
         # don't launch a session, and report back to the launcher web app with
         # the ldap info for debugging
+        release_admission(fedid)
         response = {
             'username': fedid,
             'was_session_launched': False,
@@ -508,17 +2169,20 @@ def start_hebi():
 
     # check if the user already has a session running before attempting to
     # launch one
-    user_pods = k8s_api_v1.list_namespaced_pod(
-            namespace='hebi',
-            label_selector='app={}'.format('hebi-' + fedid))
+    with trace_span('pod_existence_check'):
+        user_pods = k8s_api_v1.list_namespaced_pod(
+                namespace='hebi',
+                label_selector='app={}'.format('hebi-' + fedid))
     is_user_pod_present = (user_pods.items != [])
 
-    user_services = k8s_api_v1.list_namespaced_service(
-            namespace='hebi',
-            field_selector='metadata.name={}'.format('hebi-service-' + fedid))
+    with trace_span('service_existence_check'):
+        user_services = k8s_api_v1.list_namespaced_service(
+                namespace='hebi',
+                field_selector='metadata.name={}'.format('hebi-service-' + fedid))
     is_user_service_present = (user_services.items != [])
 
     if is_user_pod_present and is_user_service_present:
+        release_admission(fedid)
         response = {
             'username': fedid,
             'was_session_launched': False,
@@ -527,15 +2191,43 @@ def start_hebi():
         }
         return json.dumps(response)
 
+    # render the Deployment first, so then the resources that the session
+    # needs are known before deciding if it can be launched yet
+    deployment_template = env.get_template('deployment.yaml')
+    deployment_vars = {
+        'fedid': fedid,
+        'uid': uid,
+        'gid': uid,
+        'service': 'https://hebi.diamond.ac.uk/' + fedid + '/',
+        'cas_server': 'https://auth.diamond.ac.uk/cas',
+        'websocket_server': 'https://hebi.diamond.ac.uk',
+        'resources': get_session_container_resources(fedid)
+    }
+    with trace_span('template_render', template='deployment.yaml'):
+        deployment_yaml = deployment_template.render(deployment_vars)
+        deployment_doc = yaml.safe_load(deployment_yaml)
+
+    # wait in the queue if there isn't enough room in the cluster for the
+    # session yet, rather than creating a Deployment whose Pod would be stuck
+    # in Pending (unless they were already admitted from the queue above)
+    if admission is None:
+        with trace_span('admission'):
+            admission = request_admission(
+                fedid, get_session_resource_requirements(deployment_doc))
+    if not admission['admitted']:
+        return json.dumps(get_queued_response(fedid, admission))
+
     # create Service
-    service_template = env.get_template('service.yaml')
-    service_yaml = service_template.render(fedid=fedid)
+    with trace_span('template_render', template='service.yaml'):
+        service_template = env.get_template('service.yaml')
+        service_yaml = service_template.render(fedid=fedid)
+        service_doc = yaml.safe_load(service_yaml)
 
-    service_doc = yaml.safe_load(service_yaml)
     try:
-        resp = k8s_api_v1.create_namespaced_service(
-            body=service_doc, namespace='hebi'
-        )
+        with trace_span('service_create'):
+            resp = k8s_api_v1.create_namespaced_service(
+                body=service_doc, namespace='hebi'
+            )
         logger.info(f"Service created for {fedid}: {resp.metadata.name}")
     except ApiException as ae:
         err_str = f"Something went wrong with creating the Service for " \
@@ -548,22 +2240,11 @@ def start_hebi():
     add_route_to_ingress(ingress_config, fedid)
 
     # create Deployment
-    deployment_template = env.get_template('deployment.yaml')
-    deployment_vars = {
-        'fedid': fedid,
-        'uid': uid,
-        'gid': uid,
-        'service': 'https://hebi.diamond.ac.uk/' + fedid + '/',
-        'cas_server': 'https://auth.diamond.ac.uk/cas',
-        'websocket_server': 'https://hebi.diamond.ac.uk'
-    }
-    deployment_yaml = deployment_template.render(deployment_vars)
-
-    deployment_doc = yaml.safe_load(deployment_yaml)
     try:
-        resp = k8s_apps_v1.create_namespaced_deployment(
-            body=deployment_doc, namespace='hebi'
-        )
+        with trace_span('deployment_create'):
+            resp = k8s_apps_v1.create_namespaced_deployment(
+                body=deployment_doc, namespace='hebi'
+            )
         logger.info(f"Deployment created for {fedid}: {resp.metadata.name}")
     except ApiException as ae:
         err_str = f"Something went wrong with creating the Deployment for "\
@@ -571,27 +2252,65 @@ def start_hebi():
         logger.error(err_str)
         print(err_str)
 
-    # Poll for pod status on startup
+    # Poll for pod status on startup, recording a span for each state that the
+    # Pod passes through on its way to Running
     watch_pod = watch.Watch()
+    pod_state = None
+    pod_state_start = time.time()
+    is_pod_running = False
     for event in watch_pod.stream(
             k8s_api_v1.list_namespaced_pod,
             namespace='hebi',
-            label_selector='app={}'.format('hebi-' + fedid)):
+            label_selector='app={}'.format('hebi-' + fedid),
+            timeout_seconds=POD_STARTUP_TIMEOUT):
         status = event['object'].status.phase
+        new_pod_state = get_pod_startup_state(event['object'])
+        if new_pod_state != pod_state:
+            now = time.time()
+            if pod_state is not None:
+                add_span(f"pod_{pod_state}", pod_state_start,
+                         (now - pod_state_start) * 1000)
+            pod_state = new_pod_state
+            pod_state_start = now
         if status == 'Running':
+            is_pod_running = True
             watch_pod.stop()
             logger.info(f"Pod in {fedid}'s Deployment is now running")
+            set_session_pods_index_entry(
+                fedid, get_session_pod_info(event['object']))
             break
 
+    if not is_pod_running:
+        logger.error(f"Pod in {fedid}'s Deployment wasn't running after "
+                     f"{POD_STARTUP_TIMEOUT} seconds")
+
     response = {
         'username': fedid,
         'was_session_launched': True,
-        'is_hebi_pod_running': True
+        'is_hebi_pod_running': is_pod_running
     }
 
     return json.dumps(response)
 
 
+@app.route('/k8s/traces')
+def get_traces():
+    '''
+    Get the most recent traces of session launches/deletions for a user, to
+    help with explaining why a particular launch was slow
+    '''
+    require_admin()
+    data = request.args.to_dict()
+    if 'fedid' not in data:
+        abort(400)
+    try:
+        limit = min(MAX_TRACES_PER_REQUEST, max(1, int(data.get('limit', 20))))
+    except ValueError:
+        abort(400)
+    traces = get_traces_for_user(data['fedid'], limit)
+    return json.dumps(traces)
+
+
 @app.route('/k8s/stop_hebi')
 def stop_hebi():
     '''
@@ -608,9 +2327,7 @@ def stop_hebi():
     # check if FedID is in the request or not; if not, it's in the cookie in
     # the web browser
     if 'fedid' not in data:
-        cookie = request.cookies.get('token')
-        payload = jwt.decode(cookie, os.environ['JWT_KEY'], algorithms=[JWT_ALGORITHM])
-        fedid = payload['username']
+        fedid = get_fedid_from_request()
     else:
         fedid = data['fedid']
 
@@ -619,6 +2336,22 @@ def stop_hebi():
     return json.dumps(response)
 
 
+def get_pod_startup_state(pod):
+    '''
+    Get the state of a Pod as it starts up, distinguishing between a Pod that
+    is Pending because it is waiting to be scheduled and a Pod that is Pending
+    because its containers are being created
+    '''
+    if pod.status.phase != 'Pending':
+        return pod.status.phase
+    for container_status in pod.status.container_statuses or []:
+        waiting = container_status.state.waiting
+        if waiting is not None and waiting.reason == 'ContainerCreating':
+            return 'ContainerCreating'
+    return 'Pending'
+
+
+@traced('delete_hebi_k8s_resources')
 def delete_hebi_k8s_resources(fedid):
     '''
     Delete the relevant k8s resources of a user
@@ -630,18 +2363,20 @@ def delete_hebi_k8s_resources(fedid):
     try:
         # delete Deployment
         deployment_name = 'hebi-' + fedid
-        resp = k8s_apps_v1.delete_namespaced_deployment(
-            name=deployment_name, namespace='hebi', pretty='true',
-            grace_period_seconds=0, propagation_policy='Background'
-        )
+        with trace_span('deployment_delete'):
+            resp = k8s_apps_v1.delete_namespaced_deployment(
+                name=deployment_name, namespace='hebi', pretty='true',
+                grace_period_seconds=0, propagation_policy='Background'
+            )
         logger.info(f"Deployment deleted for {fedid}: {deployment_name}")
 
         # delete Service
         service_name = 'hebi-service-' + fedid
-        resp = k8s_api_v1.delete_namespaced_service(
-            name=service_name, namespace='hebi', pretty='true',
-            grace_period_seconds=0, propagation_policy='Background'
-        )
+        with trace_span('service_delete'):
+            resp = k8s_api_v1.delete_namespaced_service(
+                name=service_name, namespace='hebi', pretty='true',
+                grace_period_seconds=0, propagation_policy='Background'
+            )
         logger.info(f"Service deleted for {fedid}: {service_name}")
 
         # remove route to this deleted Service from the Ingress
@@ -653,6 +2388,7 @@ def delete_hebi_k8s_resources(fedid):
 
         # remove the user's session timestamp info from all_sessions_activity
         all_sessions_activity.pop(fedid, None)
+        set_session_pods_index_entry(fedid, None)
     except ApiException as ae:
         err_str = f"Something went wrong with stopping a Hebi session when " \
                   f"interacting with k8s: {str(ae)}"
@@ -666,7 +2402,8 @@ def delete_hebi_k8s_resources(fedid):
 
 def main(argv):
     global IN_CLUSTER, k8s_apps_v1, k8s_api_v1, k8s_api_networking_v1, \
-        env, ldap_server, all_sessions_activity, thread_lock, logger, APP_DIR
+        env, ldap_server, all_sessions_activity, thread_lock, logger, APP_DIR, \
+        TRACE_FILE_PATH, k8s_api_custom
 
     APP_DIR = os.path.dirname(os.path.abspath(__file__))
     IN_CLUSTER = os.environ['IN_CLUSTER']
@@ -676,6 +2413,7 @@ def main(argv):
         k8s_apps_v1 = client.AppsV1Api()
         k8s_api_v1 = client.CoreV1Api()
         k8s_api_networking_v1 = client.NetworkingV1Api()
+        k8s_api_custom = client.CustomObjectsApi()
     else:
         configuration = client.Configuration()
         configuration.host = "http://localhost:8090"
@@ -683,6 +2421,7 @@ def main(argv):
         k8s_api_v1 = client.CoreV1Api(client.ApiClient(configuration=configuration))
 
     logger = setup_logger()
+    TRACE_FILE_PATH = get_trace_file_path()
 
     # attempt to load data from SESSION_ACTIVITY_FILE_PATH into
     # all_sessions_activity
@@ -695,6 +2434,20 @@ def main(argv):
     except FileNotFoundError as e:
         logger.info(f"Didn't find any file at {SESSION_ACTIVITY_FILE_PATH}, assuming that no previous session timestamps exists")
 
+    # attempt to load data from SESSION_USAGE_PROFILES_FILE_PATH into
+    # session_usage_profiles
+    try:
+        with open(SESSION_USAGE_PROFILES_FILE_PATH, 'rb') as f:
+            previous_session_usage_profiles = pickle.load(f)
+        for fedid, profile in previous_session_usage_profiles.items():
+            session_usage_profiles[fedid] = {
+                name: deque(samples, maxlen=USAGE_PROFILE_MAX_SAMPLES)
+                for name, samples in profile.items()
+            }
+        logger.info(f"Loaded usage profiles of {len(session_usage_profiles)} users from previous launcher Pod")
+    except FileNotFoundError as e:
+        logger.info(f"Didn't find any file at {SESSION_USAGE_PROFILES_FILE_PATH}, assuming that no previous usage profiles exist")
+
     logger.info('Hebi launcher has started running')
 
     signal.signal(signal.SIGINT, exit_handler)
@@ -704,6 +2457,14 @@ def main(argv):
     inactive_session_check_thread = socketio.start_background_task(check_for_inactive_sessions)
     write_session_activity_to_file_thread = socketio.start_background_task(
         write_session_activity_to_file)
+    refresh_session_pods_index_thread = socketio.start_background_task(
+        refresh_session_pods_index)
+    refresh_cluster_capacity_thread = socketio.start_background_task(
+        refresh_cluster_capacity)
+    collect_session_usage_samples_thread = socketio.start_background_task(
+        collect_session_usage_samples)
+    write_session_usage_profiles_to_file_thread = socketio.start_background_task(
+        write_session_usage_profiles_to_file)
 
     if os.environ['FLASK_MODE'] == 'production':
         socketio.run(app, host='127.0.0.1', port=8085)
@@ -0,0 +1,66 @@
+import sys
+import time
+import argparse
+import statistics
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+
+def time_requests(url, token, num_requests):
+    '''
+    Send the given number of requests to a URL with the token cookie set, and
+    return the latencies (in ms) along with the values of the
+    X-Auth-Cache-Status header in the responses
+    '''
+    latencies = []
+    cache_statuses = []
+    for _ in range(num_requests):
+        req = Request(url, headers={'Cookie': f"token={token}"})
+        start = time.perf_counter()
+        try:
+            with urlopen(req) as resp:
+                resp.read()
+                cache_status = resp.headers.get('X-Auth-Cache-Status')
+        except HTTPError as e:
+            cache_status = e.headers.get('X-Auth-Cache-Status')
+        latencies.append((time.perf_counter() - start) * 1000)
+        cache_statuses.append(cache_status)
+    return latencies, cache_statuses
+
+
+def print_latencies(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name}: mean={statistics.mean(latencies):.2f}ms "
+          f"median={statistics.median(latencies):.2f}ms p95={p95:.2f}ms")
+
+
+def main(argv):
+    '''
+    Compare the latency of the cached /auth location in the launcher's nginx
+    config against the uncached /auth/ location (which goes straight to
+    cas-auth), and report the cache hit ratio of /auth
+    '''
+    parser = argparse.ArgumentParser(
+        description='Benchmark the nginx cache for cas-auth decisions')
+    parser.add_argument('--host', default='http://localhost:8080',
+                        help='the nginx server in the launcher Pod')
+    parser.add_argument('--token', required=True,
+                        help='value of a valid token cookie')
+    parser.add_argument('-n', '--num-requests', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    uncached_latencies, _ = time_requests(
+        f"{args.host}/auth/", args.token, args.num_requests)
+    cached_latencies, cache_statuses = time_requests(
+        f"{args.host}/auth", args.token, args.num_requests)
+
+    hits = cache_statuses.count('HIT')
+    print(f"cache hit ratio: {hits}/{len(cache_statuses)} "
+          f"({hits / len(cache_statuses):.1%})")
+    print_latencies('uncached (/auth/)', uncached_latencies)
+    print_latencies('cached (/auth)', cached_latencies)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])